@@ -14,9 +14,16 @@ SERVER_PORT = 15200
 SLEEP_THREAD_SECONDS = 30
 UPTIME_UPDATE_SECONDS = 60
 SYSTEM_UPDATE_SECONDS = 20
+EXPORTER_UPDATE_SECONDS = 15
+OVERLOAD_LAG_SECONDS = 60
+OVERLOAD_OVERDUE_PERCENT = 10
+HISTORY_SIZE = 120
+PROBE_MAX_SOCKETS = 512
+RESOLVE_CACHE_SECONDS = 300
 
 IS_DEBUG = False
 IS_PRINT_INFO = False
+IS_DEBUG_ENDPOINT = False
 
 if __name__ == "__main__":
     pass
@@ -6,10 +6,13 @@ import sys
 import time
 
 import metrics.MetricClasses as M
+import metrics.History as History
+import metrics.Debug as Debug
+import metrics.Shedding as Shedding
 import app_config
 
 from config_file import read_config as read_cfg
-from prometheus_client import start_http_server
+from metrics.HttpServer import start_http_server, register_route
 
 def read_app_config():
     j, _ = read_cfg(app_config.CONFIG_FILE_NAME)
@@ -34,25 +37,39 @@ def get_config_value(cfg, name, default):
 def parse_config(cfg):
     app_config.IS_DEBUG = get_config_value(cfg, 'debug', app_config.IS_DEBUG).lower() == 'true'
     app_config.IS_PRINT_INFO = get_config_value(cfg, 'print_info', app_config.IS_PRINT_INFO).lower() == 'true'
+    app_config.IS_DEBUG_ENDPOINT = str(get_config_value(cfg, 'debug_endpoint', app_config.IS_DEBUG_ENDPOINT)).lower() == 'true'
     app_config.SLEEP_THREAD_SECONDS = get_config_value(cfg, 'interval_seconds', app_config.SLEEP_THREAD_SECONDS)
     app_config.SERVER_PORT = get_config_value(cfg, 'port', app_config.SERVER_PORT)
     app_config.UPTIME_UPDATE_SECONDS = get_config_value(cfg, 'uptime_update_seconds', app_config.UPTIME_UPDATE_SECONDS)
     app_config.SYSTEM_UPDATE_SECONDS = get_config_value(cfg, 'system_update_seconds', app_config.SYSTEM_UPDATE_SECONDS)
+    app_config.EXPORTER_UPDATE_SECONDS = get_config_value(cfg, 'exporter_update_seconds', app_config.EXPORTER_UPDATE_SECONDS)
+    app_config.OVERLOAD_LAG_SECONDS = get_config_value(cfg, 'overload_lag_seconds', app_config.SLEEP_THREAD_SECONDS * 2)
+    app_config.OVERLOAD_OVERDUE_PERCENT = get_config_value(cfg, 'overload_overdue_percent', app_config.OVERLOAD_OVERDUE_PERCENT)
     app_config.RESPONSE_PATH_SEPARATOR = get_config_value(cfg, 'response_path_separator', app_config.RESPONSE_PATH_SEPARATOR)
+    app_config.HISTORY_SIZE = int(get_config_value(cfg, 'history_size', app_config.HISTORY_SIZE))
+    app_config.PROBE_MAX_SOCKETS = int(get_config_value(cfg, 'probe_max_sockets', app_config.PROBE_MAX_SOCKETS))
+    app_config.RESOLVE_CACHE_SECONDS = get_config_value(cfg, 'resolve_cache_seconds', app_config.RESOLVE_CACHE_SECONDS)
     file_name = get_config_value(cfg, 'stop_file_name', app_config.STOP_SERVER_FILE_NAME)
     app_config.STOP_SERVER_FILE_NAME = app_config.SCRIPT_PATH + (file_name if file_name.startswith('/')  else '/' + file_name)
 
 def init_metric_entities(data):
-    return {
+    metric_objects = {
         M.DiskMetric(data),
         M.HealthMetric(data),
         M.IcmpMetric(data),
+        M.TcpMetric(data),
+        M.DnsMetric(data),
         M.InterfaceMetric(data),
+        M.ProcessMetric(data),
         M.RestValueMetric(data),
         M.ShellValueMetric(data),
         M.UptimeMetric(app_config.UPTIME_UPDATE_SECONDS),
-        M.SystemMetric(app_config.SYSTEM_UPDATE_SECONDS)
+        M.SystemMetric(app_config.SYSTEM_UPDATE_SECONDS),
+        M.ExporterMetric(app_config.EXPORTER_UPDATE_SECONDS)
     }
+    for m in metric_objects:
+        m.set_priorities()
+    return metric_objects
 
 def is_need_to_reload_config():
     return app_config.CONFIG_METRICS_FILE_TIMESTAMP != os.path.getmtime(app_config.CONFIG_METRICS_FILE_NAME)
@@ -71,8 +88,15 @@ def print_config_info_debug():
     print(f'\tSLEEP_THREAD_SECONDS={app_config.SLEEP_THREAD_SECONDS}')
     print(f'\tUPTIME_UPDATE_SECONDS={app_config.UPTIME_UPDATE_SECONDS}')
     print(f'\tSYSTEM_UPDATE_SECONDS={app_config.SYSTEM_UPDATE_SECONDS}')
+    print(f'\tEXPORTER_UPDATE_SECONDS={app_config.EXPORTER_UPDATE_SECONDS}')
+    print(f'\tOVERLOAD_LAG_SECONDS={app_config.OVERLOAD_LAG_SECONDS}')
+    print(f'\tOVERLOAD_OVERDUE_PERCENT={app_config.OVERLOAD_OVERDUE_PERCENT}')
+    print(f'\tHISTORY_SIZE={app_config.HISTORY_SIZE}')
+    print(f'\tPROBE_MAX_SOCKETS={app_config.PROBE_MAX_SOCKETS}')
+    print(f'\tRESOLVE_CACHE_SECONDS={app_config.RESOLVE_CACHE_SECONDS}')
     print(f'\t---')
     print(f'\tIS_PRINT_INFO={app_config.IS_PRINT_INFO}')
+    print(f'\tIS_DEBUG_ENDPOINT={app_config.IS_DEBUG_ENDPOINT}')
 
 def main():
     print(f'-=: Collector started (version {app_config.APP_VERSION}) :=-')
@@ -85,6 +109,11 @@ def main():
     metrics_config, app_config.INSTANCE_PREFIX = read_metrics_config()
     metric_objects = init_metric_entities(metrics_config)
 
+    if app_config.HISTORY_SIZE > 0:
+        register_route('/history', History.history_handler)
+    if app_config.IS_DEBUG_ENDPOINT:
+        for path, handler in Debug.get_routes().items():
+            register_route(path, handler)
     start_http_server(app_config.SERVER_PORT)
 
     while True:
@@ -96,13 +125,19 @@ def main():
         if is_need_to_reload_config():
             print('-=: Reloading metrics configuration :=-')
             metrics_config, app_config.INSTANCE_PREFIX = read_metrics_config()
+            reloaded_at = time.time()
             metric_objects = init_metric_entities(metrics_config)
+            # every metric records its first sample on init, the history of removed ones isn't needed anymore
+            History.prune(reloaded_at)
             print('-=: Metrics configuration reloaded :=-')
 
+        loop_started = time.monotonic()
         for m in metric_objects:
             m.proceed_metric()
             if app_config.IS_DEBUG:
                 m.print_debug_info()
+        M.ExporterMetric.set_loop_time(time.monotonic() - loop_started)
+        Shedding.update(metric_objects, app_config.INSTANCE_PREFIX)
 
         if app_config.IS_DEBUG:
             print('- - -')
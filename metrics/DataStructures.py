@@ -1,3 +1,6 @@
+import gc
+import os
+import threading
 import time
 from threading import Thread
 
@@ -5,6 +8,9 @@ import psutil
 from prometheus_client import Gauge, Enum, Counter, REGISTRY
 
 import app_config
+import metrics.History as History
+from metrics.Debug import get_in_flight_count
+from metrics.Sensors import SensorCache, TEMPERATURE
 
 ENUM_UP_DN_STATES = ['up', 'dn']
 
@@ -40,17 +46,30 @@ def get_enum_metric(metric_name, descr, states, labels=None):
             metric = Enum(metric_name, descr, states=states)
     return metric
 
+def remove_labels(metric, *labels):
+    try:
+        metric.remove(*labels)
+    except KeyError:
+        pass
+
 def get_time_millis():
     return round(time.time() * 1000)
 
 
 class AbstractData:
+    # counters totals by (metric, labels) to keep their history equal to the exported *_total series
+    counter_totals = {}
     g_collect: Gauge
     def __init__(self, name, interval, prefix=''):
         self.name = name
         self.interval = interval
         self.instance_prefix = prefix
         self.updated_at = int(time.time())
+        self.priority = 'normal'
+        self.stretch = 1
+        self.stretched_at = 0
+        self.lag = 0
+        self.in_flight = False
         self.g_collect = get_gauge_metric('das_collect_time_ms',
                                           'Total time spent collecting metrics [name] on [server] in milliseconds',
                                           ['server', 'name'])
@@ -66,12 +85,42 @@ class AbstractData:
     def set_update_time(self):
         self.updated_at = int(time.time())
 
+    def get_overdue(self, now):
+        return now - (self.updated_at + self.interval * self.stretch)
+
     def is_need_to_update(self):
-        return self.updated_at + self.interval <= int(time.time())
+        # an item with its probe still running isn't dispatched again, it's counted as overdue probe by shedding
+        if self.in_flight:
+            return False
+        overdue = self.get_overdue(int(time.time()))
+        if overdue >= 0:
+            # the lag is measured at dispatch; right after the interval was shortened the item is late by design
+            if self.updated_at >= self.stretched_at:
+                self.lag = max(self.lag, overdue)
+            return True
+        return False
 
     def set_collect_time(self, value=0):
         self.g_collect.labels(server=self.instance_prefix, name=self.name).set(value)
 
+    def add_history(self, metric_name, value, **labels):
+        History.record(metric_name, {k: str(v) for k, v in labels.items()}, value)
+
+    def remove_history(self, metric_name, **labels):
+        History.remove(metric_name, {k: str(v) for k, v in labels.items()})
+
+    def add_enum_history(self, metric_name, is_up, **labels):
+        # one sample per state with the state label named as the metric, the same way the Enum is exposed
+        state = ENUM_UP_DN_STATES[0] if is_up else ENUM_UP_DN_STATES[1]
+        for s in ENUM_UP_DN_STATES:
+            self.add_history(metric_name, 1 if s == state else 0, **labels, **{metric_name: s})
+
+    def add_counter(self, counter, metric_name, amount, **labels):
+        counter.labels(**labels).inc(amount)
+        key = (metric_name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        self.counter_totals[key] = self.counter_totals.get(key, 0) + amount
+        self.add_history(f'{metric_name}_total', self.counter_totals[key], **labels)
+
     def print_trigger_info(self):
         if app_config.IS_PRINT_INFO:
             print(f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())} [INFO]: Touch "{self.name}"')
@@ -98,6 +147,8 @@ class DiskData(AbstractData):
         self.g_all.labels(name=self.name, mount=self.mount_point, server=self.instance_prefix, metric='total').set(total)
         self.g_all.labels(name=self.name, mount=self.mount_point, server=self.instance_prefix, metric='used').set(used)
         self.g_all.labels(name=self.name, mount=self.mount_point, server=self.instance_prefix, metric='free').set(free)
+        for metric, value in (('total', total), ('used', used), ('free', free)):
+            self.add_history('das_disk_bytes', value, name=self.name, mount=self.mount_point, server=self.instance_prefix, metric=metric)
         self.set_collect_time(get_time_millis() - time_ms)
         self.set_update_time()
         self.print_trigger_info()
@@ -105,10 +156,15 @@ class DiskData(AbstractData):
 
 class HealthData(AbstractData):
     e_state: Enum
-    def __init__(self, name, url, interval, timeout, is_up=False, method='GET', user=None, password=None, headers=None, prefix=''):
+    g_status: Gauge
+    g_response: Gauge
+    def __init__(self, name, url, interval, timeout, is_up=False, method='GET', user=None, password=None, headers=None, prefix='',
+                 status_code=0, response_time=0.0, expected_status=None):
         super().__init__(name, interval, prefix)
         if headers is None:
             headers = {}
+        if expected_status is None:
+            expected_status = [(200, 200)]
         self.url = url
         self.timeout = timeout
         self.is_up = is_up
@@ -116,16 +172,34 @@ class HealthData(AbstractData):
         self.user = user
         self.password = password
         self.headers = headers
+        self.status_code = status_code
+        self.response_time = response_time
+        self.expected_status = expected_status
         self.e_state = get_enum_metric('das_service_health',
                                        'Service [name, url, method, server] health',
                                        ENUM_UP_DN_STATES,['name', 'url', 'method', 'server'])
         self.e_state.labels(name=name, url=url, method=method, server=self.instance_prefix)
-        self.set_data(is_up)
-
-    def set_data(self, is_up):
+        self.g_status = get_gauge_metric('das_service_status_code',
+                                         'Service [name, url, method, server] response status code, 0 if no response',
+                                         ['name', 'url', 'method', 'server'])
+        self.g_status.labels(name=name, url=url, method=self.method, server=self.instance_prefix)
+        self.g_response = get_gauge_metric('das_service_response_ms',
+                                           'Service [name, url, method, server] response headers time in milliseconds',
+                                           ['name', 'url', 'method', 'server'])
+        self.g_response.labels(name=name, url=url, method=self.method, server=self.instance_prefix)
+        self.set_data(is_up, status_code, response_time)
+
+    def set_data(self, is_up, status_code=0, response_time=0.0):
         time_ms = get_time_millis()
         self.is_up = is_up
+        self.status_code = status_code
+        self.response_time = response_time
         self.e_state.labels(name=self.name, url=self.url, method=self.method, server=self.instance_prefix).state(ENUM_UP_DN_STATES[0] if is_up else ENUM_UP_DN_STATES[1])
+        self.g_status.labels(name=self.name, url=self.url, method=self.method, server=self.instance_prefix).set(status_code)
+        self.g_response.labels(name=self.name, url=self.url, method=self.method, server=self.instance_prefix).set(response_time)
+        self.add_enum_history('das_service_health', is_up, name=self.name, url=self.url, method=self.method, server=self.instance_prefix)
+        self.add_history('das_service_status_code', status_code, name=self.name, url=self.url, method=self.method, server=self.instance_prefix)
+        self.add_history('das_service_response_ms', response_time, name=self.name, url=self.url, method=self.method, server=self.instance_prefix)
         self.set_collect_time(get_time_millis() - time_ms)
         self.set_update_time()
         self.print_trigger_info()
@@ -157,9 +231,11 @@ class RestValueData(AbstractData):
         time_ms = get_time_millis()
         self.value = value
         try:
-            self.g_value.labels(name=self.name, url=self.url, method=self.method, server=self.instance_prefix).set(int(value))
+            number = int(value)
         except:
-            self.g_value.labels(name=self.name, url=self.url, method=self.method, server=self.instance_prefix).set(0)
+            number = 0
+        self.g_value.labels(name=self.name, url=self.url, method=self.method, server=self.instance_prefix).set(number)
+        self.add_history('das_rest_value', number, name=self.name, url=self.url, method=self.method, server=self.instance_prefix)
 
         self.set_collect_time(get_time_millis() - time_ms)
         self.set_update_time()
@@ -185,9 +261,11 @@ class ShellValueData(AbstractData):
         time_ms = get_time_millis()
         self.value = value
         try:
-            self.g_value.labels(name=self.name, command=self.command, server=self.instance_prefix).set(int(value))
+            number = int(value)
         except:
-            self.g_value.labels(name=self.name, command=self.command, server=self.instance_prefix).set(0)
+            number = 0
+        self.g_value.labels(name=self.name, command=self.command, server=self.instance_prefix).set(number)
+        self.add_history('das_shell_value', number, name=self.name, command=self.command, server=self.instance_prefix)
 
         self.set_collect_time(get_time_millis() - time_ms)
         self.set_update_time()
@@ -211,11 +289,145 @@ class IcmpData(AbstractData):
         time_ms = get_time_millis()
         self.is_up = is_up
         self.e_state.labels(name=self.name, ip=self.ip, server=self.instance_prefix).state(ENUM_UP_DN_STATES[0] if is_up else ENUM_UP_DN_STATES[1])
+        self.add_enum_history('das_host_available', is_up, name=self.name, ip=self.ip, server=self.instance_prefix)
+        self.set_collect_time(get_time_millis() - time_ms)
+        self.set_update_time()
+        self.print_trigger_info()
+
+
+class TcpData(AbstractData):
+    e_state: Enum
+    g_latency: Gauge
+    def __init__(self, name, host, port, interval, timeout, is_up=False, latency=0.0, prefix=''):
+        super().__init__(name, interval, prefix)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.address = None
+        self.resolved_at = None
+        self.is_up = is_up
+        self.latency = latency
+        self.e_state = get_enum_metric('das_tcp_available',
+                                       'TCP port [name, host, port, server] availability',
+                                       ENUM_UP_DN_STATES, ['name', 'host', 'port', 'server'])
+        self.e_state.labels(name=name, host=host, port=port, server=self.instance_prefix)
+        self.g_latency = get_gauge_metric('das_tcp_connect_ms',
+                                          'TCP connect time to [name, host, port, server] in milliseconds',
+                                          ['name', 'host', 'port', 'server'])
+        self.g_latency.labels(name=name, host=host, port=port, server=self.instance_prefix)
+
+    def set_data(self, is_up, latency):
+        time_ms = get_time_millis()
+        self.is_up = is_up
+        self.latency = latency
+        self.e_state.labels(name=self.name, host=self.host, port=self.port, server=self.instance_prefix).state(ENUM_UP_DN_STATES[0] if is_up else ENUM_UP_DN_STATES[1])
+        self.g_latency.labels(name=self.name, host=self.host, port=self.port, server=self.instance_prefix).set(latency)
+        self.add_enum_history('das_tcp_available', is_up, name=self.name, host=self.host, port=str(self.port), server=self.instance_prefix)
+        self.add_history('das_tcp_connect_ms', latency, name=self.name, host=self.host, port=str(self.port), server=self.instance_prefix)
         self.set_collect_time(get_time_millis() - time_ms)
         self.set_update_time()
         self.print_trigger_info()
 
 
+class DnsData(AbstractData):
+    e_state: Enum
+    g_latency: Gauge
+    def __init__(self, name, query, record_type, dns_server, dns_port, interval, timeout, is_up=False, latency=0.0, prefix=''):
+        super().__init__(name, interval, prefix)
+        self.query = query
+        self.type = record_type.upper()
+        self.dns_server = dns_server
+        self.dns_port = dns_port
+        self.address = None
+        self.resolved_at = None
+        self.timeout = timeout
+        self.is_up = is_up
+        self.latency = latency
+        self.e_state = get_enum_metric('das_dns_available',
+                                       'DNS record [name, query, type, resolver, server] resolving',
+                                       ENUM_UP_DN_STATES, ['name', 'query', 'type', 'resolver', 'server'])
+        self.e_state.labels(name=name, query=query, type=self.type, resolver=dns_server, server=self.instance_prefix)
+        self.g_latency = get_gauge_metric('das_dns_resolve_ms',
+                                          'DNS record [name, query, type, resolver, server] resolve time in milliseconds',
+                                          ['name', 'query', 'type', 'resolver', 'server'])
+        self.g_latency.labels(name=name, query=query, type=self.type, resolver=dns_server, server=self.instance_prefix)
+
+    def set_data(self, is_up, latency):
+        time_ms = get_time_millis()
+        self.is_up = is_up
+        self.latency = latency
+        self.e_state.labels(name=self.name, query=self.query, type=self.type, resolver=self.dns_server,
+                            server=self.instance_prefix).state(ENUM_UP_DN_STATES[0] if is_up else ENUM_UP_DN_STATES[1])
+        self.g_latency.labels(name=self.name, query=self.query, type=self.type, resolver=self.dns_server,
+                              server=self.instance_prefix).set(latency)
+        self.add_enum_history('das_dns_available', is_up, name=self.name, query=self.query, type=self.type,
+                         resolver=self.dns_server, server=self.instance_prefix)
+        self.add_history('das_dns_resolve_ms', latency, name=self.name, query=self.query, type=self.type,
+                         resolver=self.dns_server, server=self.instance_prefix)
+        self.set_collect_time(get_time_millis() - time_ms)
+        self.set_update_time()
+        self.print_trigger_info()
+
+
+class ProcessData(AbstractData):
+    PROCESS_METRICS = ['count', 'cpu_percent', 'rss_bytes', 'threads', 'fds']
+    # published top series labels by (server, name), kept across config reloads to remove the stale ones
+    top_labels = {}
+    g_group: Gauge
+    g_top: Gauge
+    def __init__(self, name, interval, match='', is_cmdline=False, top=0, sort='cpu', prefix=''):
+        super().__init__(name, interval, prefix)
+        self.match = match
+        self.is_cmdline = is_cmdline
+        self.top = top
+        self.sort = sort
+        self.summary = ()
+        if top:
+            self.g_top = get_gauge_metric('das_process_top',
+                                          'Top processes [name, rank, process, server] by cpu or rss [metric=(cpu_percent|rss_bytes|threads|fds)]',
+                                          ['name', 'rank', 'process', 'metric', 'server'])
+        else:
+            self.g_group = get_gauge_metric('das_process_group',
+                                            'Processes group [name, server] summary [metric=(count|cpu_percent|rss_bytes|threads|fds)]',
+                                            ['name', 'metric', 'server'])
+            for metric in self.PROCESS_METRICS:
+                self.g_group.labels(name=name, metric=metric, server=self.instance_prefix)
+
+    def set_data(self, summary):
+        time_ms = get_time_millis()
+        self.summary = summary
+        if self.top:
+            self.set_top(summary)
+        else:
+            for metric, value in zip(self.PROCESS_METRICS, summary):
+                self.g_group.labels(name=self.name, metric=metric, server=self.instance_prefix).set(value)
+                self.add_history('das_process_group', value, name=self.name, metric=metric, server=self.instance_prefix)
+        self.set_collect_time(get_time_millis() - time_ms)
+        self.set_update_time()
+        self.print_trigger_info()
+
+    def set_top(self, processes):
+        labels = set()
+        for rank, (pid, comm, cpu, rss, threads, fds) in enumerate(processes, 1):
+            process = f'{comm}:{pid}'
+            for metric, value in zip(self.PROCESS_METRICS[1:], (cpu, rss, threads, fds)):
+                labels.add((str(rank), process, metric))
+                self.g_top.labels(name=self.name, rank=rank, process=process, metric=metric, server=self.instance_prefix).set(value)
+        # processes out of the top are removed to not keep their series forever
+        key = (self.instance_prefix, self.name)
+        for rank, process, metric in self.top_labels.get(key, set()) - labels:
+            remove_labels(self.g_top, self.name, rank, process, metric, self.instance_prefix)
+        self.top_labels[key] = labels
+
+    @classmethod
+    def remove_top(cls, prefix, names):
+        # removes the top series of the items which are not in the config anymore
+        g_top = get_metric('das_process_top')
+        for key in [k for k in cls.top_labels if k[0] == prefix and k[1] not in names]:
+            for rank, process, metric in cls.top_labels.pop(key):
+                remove_labels(g_top, key[1], rank, process, metric, prefix)
+
+
 class InterfaceData(AbstractData):
     g_all: Counter
     def __init__(self, name, iface, interval, sent, receive, prefix=''):
@@ -236,8 +448,8 @@ class InterfaceData(AbstractData):
         recv_delta = receive - self.receive
         self.sent = sent
         self.receive = receive
-        self.g_all.labels(name=self.name, server=self.instance_prefix, metric='sent').inc(sent_delta)
-        self.g_all.labels(name=self.name, server=self.instance_prefix, metric='receive').inc(recv_delta)
+        self.add_counter(self.g_all, 'das_net_interface_bytes', sent_delta, name=self.name, server=self.instance_prefix, metric='sent')
+        self.add_counter(self.g_all, 'das_net_interface_bytes', recv_delta, name=self.name, server=self.instance_prefix, metric='receive')
         self.set_collect_time(get_time_millis() - time_ms)
         self.set_update_time()
         self.print_trigger_info()
@@ -258,23 +470,133 @@ class UptimeData(AbstractData):
     def set_data(self):
         time_ms = get_time_millis()
         uptime = int(time.time()) - self.START_TIME
-        self.c_uptime.labels(server=self.instance_prefix).inc(uptime - self.uptime)
+        self.add_counter(self.c_uptime, 'das_exporter_uptime', uptime - self.uptime, server=self.instance_prefix)
         self.uptime = uptime
         self.set_collect_time(get_time_millis() - time_ms)
         self.set_update_time()
         self.print_trigger_info()
 
 
+class ExporterData(AbstractData):
+    # filled by the gc callback and the main loop; plain numbers only, no metric locks taken there
+    gc_started = [0.0, 0.0, 0.0]
+    gc_collections = [0, 0, 0]
+    gc_pause = [0.0, 0.0, 0.0]
+    gc_max_pause = 0.0
+    loop_time = 0.0
+    loop_overruns = 0
+    # values already published to the counters, kept between metrics configuration reloads
+    published = {}
+    g_threads: Gauge
+    g_fds: Gauge
+    g_rss: Gauge
+    c_gc_collections: Counter
+    c_gc_pause: Counter
+    g_gc_max_pause: Gauge
+    g_loop: Gauge
+    c_overruns: Counter
+    g_probes: Gauge
+    def __init__(self, interval, prefix=''):
+        super().__init__('exporter', interval, prefix)
+        self.process = psutil.Process()
+        self.threads, self.fds, self.rss, self.probes = 0, 0, 0, 0
+        if ExporterData.on_gc not in gc.callbacks:
+            gc.callbacks.append(ExporterData.on_gc)
+        self.init_metrics()
+        self.set_data()
+
+    @staticmethod
+    def on_gc(phase, info):
+        generation = info['generation']
+        if phase == 'start':
+            ExporterData.gc_started[generation] = time.perf_counter()
+        else:
+            pause = time.perf_counter() - ExporterData.gc_started[generation]
+            ExporterData.gc_collections[generation] += 1
+            ExporterData.gc_pause[generation] += pause
+            ExporterData.gc_max_pause = max(ExporterData.gc_max_pause, pause)
+
+    @staticmethod
+    def set_loop_time(seconds):
+        ExporterData.loop_time = seconds
+        if seconds > app_config.SLEEP_THREAD_SECONDS:
+            ExporterData.loop_overruns += 1
+
+    def init_metrics(self):
+        self.g_threads = get_gauge_metric('das_exporter_threads', 'Exporter live threads on [server]', ['server'])
+        self.g_threads.labels(server=self.instance_prefix)
+        self.g_fds = get_gauge_metric('das_exporter_open_fds', 'Exporter open file descriptors (handles on Windows) on [server]', ['server'])
+        self.g_fds.labels(server=self.instance_prefix)
+        self.g_rss = get_gauge_metric('das_exporter_rss_bytes', 'Exporter resident memory on [server] in bytes', ['server'])
+        self.g_rss.labels(server=self.instance_prefix)
+        self.g_probes = get_gauge_metric('das_exporter_probes_in_flight', 'Exporter probes running now on [server]', ['server'])
+        self.g_probes.labels(server=self.instance_prefix)
+        self.c_gc_collections = get_counter_metric('das_exporter_gc_collections', 'Exporter GC collections of [generation] on [server]',
+                                                   ['generation', 'server'])
+        self.c_gc_pause = get_counter_metric('das_exporter_gc_pause_seconds', 'Exporter GC pauses of [generation] on [server] in seconds',
+                                             ['generation', 'server'])
+        for generation in range(3):
+            self.c_gc_collections.labels(generation=generation, server=self.instance_prefix)
+            self.c_gc_pause.labels(generation=generation, server=self.instance_prefix)
+        self.g_gc_max_pause = get_gauge_metric('das_exporter_gc_max_pause_seconds',
+                                               'Exporter longest GC pause since previous update on [server] in seconds', ['server'])
+        self.g_gc_max_pause.labels(server=self.instance_prefix)
+        self.g_loop = get_gauge_metric('das_exporter_loop_seconds', 'Exporter main loop [metric=(last|interval)] duration on [server] in seconds',
+                                       ['metric', 'server'])
+        self.g_loop.labels(metric='last', server=self.instance_prefix)
+        self.g_loop.labels(metric='interval', server=self.instance_prefix)
+        self.c_overruns = get_counter_metric('das_exporter_loop_overruns', 'Exporter main loop iterations longer than interval on [server]',
+                                             ['server'])
+        self.c_overruns.labels(server=self.instance_prefix)
+
+    def inc_counter(self, counter, metric_name, value, **labels):
+        # counters are incremented by delta from the value published before
+        key = (self.instance_prefix, metric_name, tuple(labels.items()))
+        self.add_counter(counter, metric_name, value - self.published.get(key, 0), server=self.instance_prefix, **labels)
+        self.published[key] = value
+
+    def set_data(self):
+        time_ms = get_time_millis()
+        self.threads = threading.active_count()
+        self.fds = self.process.num_fds() if os.name == 'posix' else self.process.num_handles()
+        self.rss = self.process.memory_info().rss
+        self.probes = get_in_flight_count()
+        self.g_threads.labels(server=self.instance_prefix).set(self.threads)
+        self.g_fds.labels(server=self.instance_prefix).set(self.fds)
+        self.g_rss.labels(server=self.instance_prefix).set(self.rss)
+        self.g_probes.labels(server=self.instance_prefix).set(self.probes)
+        for generation in range(3):
+            self.inc_counter(self.c_gc_collections, 'das_exporter_gc_collections', self.gc_collections[generation], generation=generation)
+            self.inc_counter(self.c_gc_pause, 'das_exporter_gc_pause_seconds', self.gc_pause[generation], generation=generation)
+        max_pause, ExporterData.gc_max_pause = ExporterData.gc_max_pause, 0.0
+        self.g_gc_max_pause.labels(server=self.instance_prefix).set(max_pause)
+        self.g_loop.labels(metric='last', server=self.instance_prefix).set(self.loop_time)
+        self.g_loop.labels(metric='interval', server=self.instance_prefix).set(app_config.SLEEP_THREAD_SECONDS)
+        self.inc_counter(self.c_overruns, 'das_exporter_loop_overruns', self.loop_overruns)
+        self.add_history('das_exporter_threads', self.threads, server=self.instance_prefix)
+        self.add_history('das_exporter_open_fds', self.fds, server=self.instance_prefix)
+        self.add_history('das_exporter_rss_bytes', self.rss, server=self.instance_prefix)
+        self.add_history('das_exporter_loop_seconds', self.loop_time, metric='last', server=self.instance_prefix)
+        self.set_collect_time(get_time_millis() - time_ms)
+        self.set_update_time()
+        self.print_trigger_info()
+
+
 class SystemData(AbstractData):
     BOOT_TIME = int(psutil.boot_time())
+    SENSORS = SensorCache()
     c_uptime: Counter
     g_cpu: Gauge
     g_memory: Gauge
     g_tempr: Gauge
-    g_cpu_temp: Gauge
+    g_sensor_temp: Gauge
+    g_sensor_fan: Gauge
+    g_sensor_up: Gauge
     def __init__(self, interval, prefix=''):
         super().__init__('system', interval, prefix)
-        self.cpu, self.memory, self.uptime, self.ch_temp, self.cpu_temp = 0,0,0,0,0
+        self.cpu, self.memory, self.uptime = 0,0,0
+        self.ch_temp, self.cpu_temp = None, None
+        self.sensors = {}
         self.init_metrics()
         self.set_data()
 
@@ -285,55 +607,72 @@ class SystemData(AbstractData):
         self.g_cpu.labels(server=self.instance_prefix)
         self.g_memory = get_gauge_metric('das_memory_percent', 'Memory used percent on [server]', ['server'])
         self.g_memory.labels(server=self.instance_prefix)
+        # temperatures have no value until they are read, unavailable ones are shown by das_sensor_up
         self.g_tempr = get_gauge_metric('das_temperature', 'Temperature of [type] overall on [server]', ['metric', 'server'])
-        self.g_tempr.labels(server=self.instance_prefix, metric='CPU')
-        self.g_tempr.labels(server=self.instance_prefix, metric='Chassis')
+        self.g_sensor_temp = get_gauge_metric('das_sensor_temperature', 'Sensor [chip, device, sensor] temperature on [server] in Celsius',
+                                              ['chip', 'device', 'sensor', 'server'])
+        self.g_sensor_fan = get_gauge_metric('das_sensor_fan_rpm', 'Fan [chip, device, sensor] speed on [server] in RPM',
+                                             ['chip', 'device', 'sensor', 'server'])
+        self.g_sensor_up = get_gauge_metric('das_sensor_up', 'Sensor [type, chip, device, sensor] on [server] is read, 0 if unavailable',
+                                            ['type', 'chip', 'device', 'sensor', 'server'])
 
     def set_data(self):
         time_ms = get_time_millis()
         uptime = int(time.time()) - self.BOOT_TIME
-        self.c_uptime.labels(server=self.instance_prefix).inc(uptime - self.uptime)
+        self.add_counter(self.c_uptime, 'das_uptime_seconds', uptime - self.uptime, server=self.instance_prefix)
         self.uptime = uptime
         self.memory = psutil.virtual_memory().percent
         self.g_memory.labels(server=self.instance_prefix).set(self.memory)
+        self.add_history('das_memory_percent', self.memory, server=self.instance_prefix)
         Thread(target=self.set_cpu_percent()).run()
 
-        try:
-            avg_temp = 0
-            temps = psutil.sensors_temperatures()
-            if 'coretemp' in temps:
-                self.cpu_temp = temps["coretemp"][0].current
-            elif 'cpu_thermal' in temps:
-                self.cpu_temp = temps["cpu_thermal"][0].current
-            else:
-                # if no coretemp we try to get an average temperature
-                temp, amount = 0, 0
-                for i in temps.keys():
-                    if i != 'acpitz':
-                        temp += temps.get(i)[0].current
-                        amount += 1
-                self.cpu_temp = temp // amount
-
-            if 'acpitz' in temps:
-                self.ch_temp = temps["acpitz"][0].current
-            else:
-                self.ch_temp = self.cpu_temp
-
-            self.g_tempr.labels(server=self.instance_prefix, metric='Chassis').set(self.ch_temp)
-            self.g_tempr.labels(server=self.instance_prefix, metric='CPU').set(self.cpu_temp)
-        except:
-            self.ch_temp = -500
-            self.cpu_temp = -500
-            self.g_tempr.labels(server=self.instance_prefix, metric='Chassis').set(self.ch_temp)
-            self.g_tempr.labels(server=self.instance_prefix, metric='CPU').set(self.cpu_temp)
-
+        self.set_sensors(self.SENSORS.read())
         self.set_collect_time(get_time_millis() - time_ms)
         self.set_update_time()
         self.print_trigger_info()
 
+    def set_sensors(self, readings):
+        sensors, temps = {}, {}
+        for (sensor_type, chip, device, sensor), value in readings:
+            sensors[(sensor_type, chip, device, sensor)] = value
+            gauge, metric_name = (self.g_sensor_temp, 'das_sensor_temperature') if sensor_type == TEMPERATURE else (self.g_sensor_fan, 'das_sensor_fan_rpm')
+            self.g_sensor_up.labels(type=sensor_type, chip=chip, device=device, sensor=sensor, server=self.instance_prefix).set(0 if value is None else 1)
+            if value is None:
+                remove_labels(gauge, chip, device, sensor, self.instance_prefix)
+                continue
+            gauge.labels(chip=chip, device=device, sensor=sensor, server=self.instance_prefix).set(value)
+            self.add_history(metric_name, value, chip=chip, device=device, sensor=sensor, server=self.instance_prefix)
+            if sensor_type == TEMPERATURE:
+                temps.setdefault(chip, value)
+        # unplugged sensors
+        for sensor_type, chip, device, sensor in self.sensors.keys() - sensors.keys():
+            remove_labels(self.g_sensor_up, sensor_type, chip, device, sensor, self.instance_prefix)
+            remove_labels(self.g_sensor_temp if sensor_type == TEMPERATURE else self.g_sensor_fan, chip, device, sensor, self.instance_prefix)
+            self.remove_history('das_sensor_temperature' if sensor_type == TEMPERATURE else 'das_sensor_fan_rpm',
+                                chip=chip, device=device, sensor=sensor, server=self.instance_prefix)
+        self.sensors = sensors
+
+        if 'coretemp' in temps:
+            self.cpu_temp = temps['coretemp']
+        elif 'cpu_thermal' in temps:
+            self.cpu_temp = temps['cpu_thermal']
+        else:
+            # if no coretemp we try to get an average temperature
+            chips = [t for chip, t in temps.items() if chip != 'acpitz']
+            self.cpu_temp = sum(chips) / len(chips) if chips else None
+        self.ch_temp = temps['acpitz'] if 'acpitz' in temps else self.cpu_temp
+
+        for metric, value in (('CPU', self.cpu_temp), ('Chassis', self.ch_temp)):
+            if value is None:
+                remove_labels(self.g_tempr, metric, self.instance_prefix)
+            else:
+                self.g_tempr.labels(server=self.instance_prefix, metric=metric).set(value)
+                self.add_history('das_temperature', value, server=self.instance_prefix, metric=metric)
+
     def set_cpu_percent(self):
         self.cpu = psutil.cpu_percent(1)
         self.g_cpu.labels(server=self.instance_prefix).set(self.cpu)
+        self.add_history('das_cpu_percent', self.cpu, server=self.instance_prefix)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,149 @@
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from threading import Thread, Lock, get_ident
+
+MAX_SECONDS = 60
+TEXT_CONTENT_TYPE = 'text/plain; charset=utf-8'
+
+_probes = {}
+_probes_lock = Lock()
+_profile_lock = Lock()
+_memory_lock = Lock()
+
+
+def run_probe(probe_id, target, args):
+    try:
+        target(*args)
+    finally:
+        with _probes_lock:
+            _probes.pop(probe_id, None)
+
+def start_probe(metric_key, name, target, args):
+    # starts probe thread the same way metrics always did and keeps it in the in-flight list until it finishes
+    probe_id = object()
+    with _probes_lock:
+        _probes[probe_id] = (metric_key, name, time.monotonic())
+    thread = Thread(target=run_probe, args=(probe_id, target, args), name=f'probe-{metric_key}-{name}')
+    thread.start()
+    return thread
+
+def get_in_flight_count():
+    return len(_probes)
+
+def get_in_flight_probes():
+    now = time.monotonic()
+    with _probes_lock:
+        probes = list(_probes.values())
+    return sorted(({'metric': key, 'name': name, 'running_seconds': round(now - started, 3)} for key, name, started in probes),
+                  key=lambda p: p['running_seconds'], reverse=True)
+
+def get_number(params, name, default, convert=float):
+    # raises ValueError on a non-numeric (or not finite) value, the handlers answer it with 400
+    value = convert(params.get(name, default))
+    if not math.isfinite(value):
+        raise ValueError(f'{name} is not finite')
+    return value
+
+def get_seconds(params, default):
+    return max(0.0, min(get_number(params, 'seconds', default), MAX_SECONDS))
+
+def bad_request(names):
+    return '400 Bad Request', TEXT_CONTENT_TYPE, f'Parameters {names} must be numbers\n'
+
+def get_frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+def sample_stacks(seconds, interval):
+    own_id = get_ident()
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            names = []
+            while frame is not None:
+                names.append(get_frame_name(frame))
+                frame = frame.f_back
+            stacks[tuple(reversed(names))] += 1
+        time.sleep(interval)
+    return stacks
+
+def to_collapsed(stacks):
+    return ''.join(f'{";".join(stack)} {count}\n' for stack, count in stacks.most_common())
+
+def to_top(stacks, limit):
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        own[stack[-1]] += count
+        for name in set(stack):
+            total[name] += count
+    samples = sum(stacks.values()) or 1
+    lines = [f'{"own %":>7} {"total %":>7} {"own":>7} {"total":>7}  function']
+    for name, count in own.most_common(limit):
+        lines.append(f'{100 * count / samples:7.2f} {100 * total[name] / samples:7.2f} {count:7d} {total[name]:7d}  {name}')
+    return '\n'.join(lines) + '\n'
+
+def profile_handler(params):
+    try:
+        seconds = get_seconds(params, 5)
+        interval = max(get_number(params, 'interval_ms', 10), 1) / 1000
+        limit = max(get_number(params, 'limit', 30, int), 0)
+    except ValueError:
+        return bad_request('"seconds", "interval_ms" and "limit"')
+    if not _profile_lock.acquire(blocking=False):
+        return '409 Conflict', TEXT_CONTENT_TYPE, 'Profiling is already running\n'
+    try:
+        stacks = sample_stacks(seconds, interval)
+    finally:
+        _profile_lock.release()
+    if params.get('format', 'collapsed') == 'top':
+        return '200 OK', TEXT_CONTENT_TYPE, to_top(stacks, limit)
+    return '200 OK', TEXT_CONTENT_TYPE, to_collapsed(stacks)
+
+def memory_handler(params):
+    try:
+        seconds = get_seconds(params, 5)
+        limit = max(get_number(params, 'limit', 20, int), 0)
+    except ValueError:
+        return bad_request('"seconds" and "limit"')
+    if not _memory_lock.acquire(blocking=False):
+        return '409 Conflict', TEXT_CONTENT_TYPE, 'Memory tracing is already running\n'
+    try:
+        is_started = not tracemalloc.is_tracing()
+        if is_started:
+            tracemalloc.start()
+            time.sleep(seconds)
+        try:
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            if is_started:
+                tracemalloc.stop()
+    finally:
+        _memory_lock.release()
+    stats = snapshot.statistics('lineno')
+    lines = [f'Top {limit} allocators of {len(stats)} (traced {"for " + str(seconds) + "s" if is_started else "since start"})']
+    for stat in stats[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f'{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}')
+    return '200 OK', TEXT_CONTENT_TYPE, '\n'.join(lines) + '\n'
+
+def probes_handler(params):
+    return '200 OK', 'application/json', json.dumps(get_in_flight_probes())
+
+def get_routes():
+    return {
+        '/debug/profile': profile_handler,
+        '/debug/memory': memory_handler,
+        '/debug/probes': probes_handler
+    }
+
+
+if __name__ == '__main__':
+    pass
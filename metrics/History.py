@@ -0,0 +1,141 @@
+import json
+import time
+from array import array
+from threading import Lock
+
+from prometheus_client import Gauge
+
+import app_config
+
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+_series = {}
+_lock = Lock()
+_g_bytes = None
+_g_series = None
+
+
+class SampleRing:
+    # fixed size ring of (timestamp, value) pairs stored in two float64 arrays
+    def __init__(self, size):
+        self.size = size
+        self.timestamps = array('d', [0.0]) * size
+        self.values = array('d', [0.0]) * size
+        self.pos = 0
+        self.count = 0
+
+    def append(self, value, timestamp):
+        self.timestamps[self.pos] = timestamp
+        self.values[self.pos] = value
+        self.pos = (self.pos + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def samples(self, since=0.0):
+        start = (self.pos - self.count) % self.size
+        result = []
+        for i in range(self.count):
+            idx = (start + i) % self.size
+            if self.timestamps[idx] > since:
+                result.append((self.timestamps[idx], self.values[idx]))
+        return result
+
+    def last_timestamp(self):
+        return self.timestamps[(self.pos - 1) % self.size] if self.count else 0.0
+
+    def memory_bytes(self):
+        return self.timestamps.itemsize * len(self.timestamps) + self.values.itemsize * len(self.values)
+
+
+def get_series_key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def record(name, labels, value, timestamp=None):
+    if app_config.HISTORY_SIZE <= 0:
+        return
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return
+    key = get_series_key(name, labels)
+    with _lock:
+        ring = _series.get(key)
+        if ring is None:
+            ring = SampleRing(app_config.HISTORY_SIZE)
+            _series[key] = ring
+            update_memory_metric()
+        ring.append(value, time.time() if timestamp is None else timestamp)
+
+def remove(name, labels):
+    with _lock:
+        if _series.pop(get_series_key(name, labels), None) is not None:
+            update_memory_metric()
+
+def prune(since):
+    # drops the series not recorded since the timestamp, i.e. of the metrics removed from configuration
+    with _lock:
+        for key in [key for key, ring in _series.items() if ring.last_timestamp() < since]:
+            del _series[key]
+        update_memory_metric()
+
+def get_bytes_per_series():
+    return SampleRing(1).memory_bytes() * app_config.HISTORY_SIZE
+
+def update_memory_metric():
+    global _g_bytes, _g_series
+    if _g_bytes is None:
+        _g_bytes = Gauge('das_exporter_history_bytes', 'History buffers memory [metric=(per_series|total)] in bytes', ['metric'])
+        _g_series = Gauge('das_exporter_history_series', 'Amount of series kept in history buffers')
+    per_series = get_bytes_per_series()
+    _g_bytes.labels(metric='per_series').set(per_series)
+    _g_bytes.labels(metric='total').set(per_series * len(_series))
+    _g_series.set(len(_series))
+
+def find_series(name, filters, since=0.0):
+    result = []
+    with _lock:
+        for (s_name, s_labels), ring in _series.items():
+            labels = dict(s_labels)
+            if s_name != name or any(labels.get(k) != v for k, v in filters.items()):
+                continue
+            result.append((labels, ring.samples(since)))
+    return result
+
+def escape_label_value(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+def to_openmetrics(name, series):
+    lines = [f'# TYPE {name} unknown']
+    for labels, samples in series:
+        label_str = ','.join(f'{k}="{escape_label_value(v)}"' for k, v in sorted(labels.items()))
+        label_str = '{' + label_str + '}' if label_str else ''
+        for ts, value in samples:
+            lines.append(f'{name}{label_str} {value!r} {ts:.3f}')
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+def to_json(name, series):
+    return json.dumps({
+        'name': name,
+        'size': app_config.HISTORY_SIZE,
+        'bytes_per_series': get_bytes_per_series(),
+        'series': [{'labels': labels, 'samples': samples} for labels, samples in series]
+    })
+
+def history_handler(params):
+    name = params.pop('name', '')
+    if not name:
+        return '400 Bad Request', 'text/plain; charset=utf-8', 'Parameter "name" is required\n'
+    out_format = params.pop('format', 'json')
+    try:
+        since = float(params.pop('since', 0))
+    except ValueError:
+        return '400 Bad Request', 'text/plain; charset=utf-8', 'Parameter "since" must be a unix timestamp\n'
+    series = find_series(name, params, since)
+    if out_format == 'openmetrics':
+        return '200 OK', OPENMETRICS_CONTENT_TYPE, to_openmetrics(name, series)
+    return '200 OK', 'application/json', to_json(name, series)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,49 @@
+from urllib.parse import parse_qs
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+from prometheus_client import make_wsgi_app
+from prometheus_client.exposition import ThreadingWSGIServer
+from threading import Thread
+
+ROUTES = {}
+
+
+class SilentHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def register_route(path, handler):
+    # handler(params) must return (status, content_type, body)
+    ROUTES[path] = handler
+
+def get_params(environ):
+    return {k: v[0] for k, v in parse_qs(environ.get('QUERY_STRING', '')).items()}
+
+def make_app():
+    metrics_app = make_wsgi_app()
+
+    def app(environ, start_response):
+        handler = ROUTES.get(environ.get('PATH_INFO', '/'))
+        if handler is None:
+            return metrics_app(environ, start_response)
+        try:
+            status, content_type, body = handler(get_params(environ))
+        except Exception as e:
+            status, content_type, body = '500 Internal Server Error', 'text/plain; charset=utf-8', str(e)
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        start_response(status, [('Content-Type', content_type), ('Content-Length', str(len(body)))])
+        return [body]
+
+    return app
+
+def start_http_server(port, addr='0.0.0.0'):
+    httpd = make_server(addr, port, make_app(), ThreadingWSGIServer, handler_class=SilentHandler)
+    thread = Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd, thread
+
+
+if __name__ == '__main__':
+    pass
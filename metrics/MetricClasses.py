@@ -1,6 +1,13 @@
+import errno
 import json
+import random
+import selectors
 import shutil
+import socket
+import struct
 from abc import abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import time
 import platform
 import subprocess
@@ -10,9 +17,14 @@ import psutil
 
 import app_config
 
-from threading import Thread
+from metrics.Debug import start_probe
+from metrics.Shedding import PRIORITIES
 from metrics.DataStructures import DiskData, HealthData, IcmpData, ENUM_UP_DN_STATES, InterfaceData, UptimeData, \
-    SystemData, RestValueData, ShellValueData
+    SystemData, RestValueData, ShellValueData, TcpData, DnsData, ExporterData, ProcessData
+from metrics.Processes import SCANNER
+
+DNS_RECORD_TYPES = {'A': 1, 'NS': 2, 'CNAME': 5, 'SOA': 6, 'PTR': 12, 'MX': 15, 'TXT': 16, 'AAAA': 28, 'SRV': 33}
+RESOLVE_MAX_THREADS = 16
 
 
 class AbstractMetric:
@@ -26,6 +38,32 @@ class AbstractMetric:
             self.config = config[key]
         self.data_array = []
 
+    def set_priorities(self):
+        if not self.metric_key:
+            # embedded metrics (uptime, system, exporter) are never shed
+            for d in self.data_array:
+                d.priority = 'high'
+            return
+        for d, c in zip(self.data_array, self.config):
+            priority = c['priority'] if 'priority' in c else 'normal'
+            if priority not in PRIORITIES:
+                raise Exception(f"Wrong priority '{priority}' of {self.metric_key} metric '{d.name}'")
+            d.priority = priority
+
+    def start_probe(self, data, name, target, args):
+        # the items are in flight until the probe thread finishes, whatever the probe result is
+        for d in data:
+            d.in_flight = True
+
+        def run_probe(*probe_args):
+            try:
+                target(*probe_args)
+            finally:
+                for item in data:
+                    item.in_flight = False
+
+        return start_probe(self.metric_key, name, run_probe, args)
+
     @abstractmethod
     def proceed_metric(self):
         pass
@@ -35,24 +73,40 @@ class AbstractMetric:
         pass
 
 
-def is_health_check(url, timeout, method, user, pwd, headers, callback=None):
-    session = requests.Session()
-    if user and pwd:
-        session.auth = (user, pwd)
-    try:
-        response = session.request(
-            url=url,
-            timeout=timeout,
-            method=method,
-            headers=headers
-        )
-        result = response.status_code == 200
-        if callback is not None:
-            callback(result)
-        else:
-            return result
-    except (requests.ConnectTimeout, requests.exceptions.ConnectionError) as e:
-        return False
+def parse_status_ranges(value):
+    # "200-299,301" or [200, "300-399"] -> [(200, 299), (301, 301)]
+    if value is None:
+        return [(200, 200)]
+    items = value.split(',') if isinstance(value, str) else value
+    ranges = []
+    for item in items:
+        low, _, high = str(item).strip().partition('-')
+        ranges.append((int(low), int(high) if high else int(low)))
+    return ranges
+
+def is_expected_status(status_code, ranges):
+    return any(low <= status_code <= high for low, high in ranges)
+
+def is_health_check(url, timeout, method, user, pwd, headers, callback=None, expected_status=None):
+    # only the status line and headers are read: the body is never downloaded and the connection is closed
+    if expected_status is None:
+        expected_status = [(200, 200)]
+    started = time.monotonic()
+    with requests.Session() as session:
+        if user and pwd:
+            session.auth = (user, pwd)
+        try:
+            with session.request(url=url, timeout=timeout, method=method, headers=headers, stream=True) as response:
+                status_code = response.status_code
+                response_time = response.elapsed.total_seconds() * 1000
+            result = is_expected_status(status_code, expected_status), status_code, response_time
+        except requests.RequestException:
+            result = False, 0, (time.monotonic() - started) * 1000
+
+    if callback is not None:
+        callback(*result)
+    else:
+        return result
 
 def get_rest_value(url, timeout, method, user, pwd, headers, callback=None, result_type='single', path=''):
     session = requests.Session()
@@ -128,11 +182,173 @@ def is_ping(ip, count, callback=None):
     else:
         return result
 
+def resolve_address(host, port, sock_type):
+    # (family, sockaddr) of the first address found or None; never called inside the selector loops
+    try:
+        family, _, _, _, address = socket.getaddrinfo(host, port, type=sock_type)[0]
+        return family, address
+    except (OSError, UnicodeError):
+        return None
+
+def refresh_addresses(data, get_host_port, sock_type):
+    # addresses are resolved once and then every app_config.RESOLVE_CACHE_SECONDS; a failed lookup is kept as long
+    # to not stall every check on a dead resolver. The lookups run in parallel, RESOLVE_MAX_THREADS at most
+    now = time.monotonic()
+    stale = [d for d in data if d.resolved_at is None or now - d.resolved_at >= app_config.RESOLVE_CACHE_SECONDS]
+    if not stale:
+        return
+    with ThreadPoolExecutor(max_workers=min(len(stale), RESOLVE_MAX_THREADS)) as executor:
+        addresses = list(executor.map(lambda d: resolve_address(*get_host_port(d), sock_type), stale))
+    for d, address in zip(stale, addresses):
+        d.address = address
+        d.resolved_at = now
+
+def check_tcp_connect(targets, callback=None):
+    # targets: list of (address, timeout), address is (family, sockaddr) from resolve_address() or None;
+    # all connects are multiplexed on one selector
+    # result: list of (is_up, latency_ms) in the targets order
+    results = [(False, 0.0)] * len(targets)
+    pending = deque(enumerate(targets))
+    selector = selectors.DefaultSelector()
+    in_flight = 0
+    try:
+        while pending or in_flight:
+            while pending and in_flight < app_config.PROBE_MAX_SOCKETS:
+                idx, (address, timeout) = pending.popleft()
+                started = time.monotonic()
+                try:
+                    if address is None:
+                        raise OSError('Address is not resolved')
+                    family, address = address
+                    sock = socket.socket(family, socket.SOCK_STREAM)
+                except OSError:
+                    results[idx] = (False, (time.monotonic() - started) * 1000)
+                    continue
+                sock.setblocking(False)
+                code = sock.connect_ex(address)
+                if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    sock.close()
+                    results[idx] = (False, (time.monotonic() - started) * 1000)
+                    continue
+                selector.register(sock, selectors.EVENT_WRITE, (idx, started, started + timeout))
+                in_flight += 1
+
+            now = time.monotonic()
+            keys = list(selector.get_map().values())
+            wait = max(0.0, min(k.data[2] for k in keys) - now) if keys else 0
+            done = [(key, True) for key, _ in selector.select(wait)]
+            now = time.monotonic()
+            done_socks = {key.fileobj for key, _ in done}
+            done += [(key, False) for key in keys if key.fileobj not in done_socks and key.data[2] <= now]
+            for key, is_ready in done:
+                idx, started, _ = key.data
+                sock = key.fileobj
+                is_up = is_ready and sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+                results[idx] = (is_up, (now - started) * 1000)
+                selector.unregister(sock)
+                sock.close()
+                in_flight -= 1
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+
+    if callback is not None:
+        callback(results)
+    else:
+        return results
+
+def build_dns_query(query_id, name, record_type):
+    header = struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0)
+    qname = b''.join(bytes([len(p)]) + p for p in (label.encode('idna') for label in name.strip('.').split('.')) if p)
+    return header + qname + b'\x00' + struct.pack('!HH', DNS_RECORD_TYPES[record_type.upper()], 1)
+
+def is_dns_answer(response):
+    if len(response) < 12:
+        return False
+    _, flags, _, answers = struct.unpack('!HHHH', response[:8])
+    return bool(flags & 0x8000) and flags & 0x000F == 0 and answers > 0
+
+def get_default_dns_server():
+    try:
+        with open('/etc/resolv.conf', 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) > 1 and parts[0] == 'nameserver':
+                    return parts[1]
+    except OSError:
+        pass
+    return '127.0.0.1'
+
+def check_dns_resolve(queries, callback=None):
+    # queries: list of (query, record_type, address, timeout), address is the resolver (family, sockaddr)
+    # from resolve_address() or None; all UDP requests are sent from one socket per address family
+    # and answers are matched by resolver address and query id
+    # result: list of (is_up, latency_ms) in the queries order
+    results = [(False, 0.0)] * len(queries)
+    pending = deque(enumerate(queries))
+    selector = selectors.DefaultSelector()
+    sockets = {}
+    waiting = {}
+    query_id = random.randrange(0x10000)
+    try:
+        while pending or waiting:
+            while pending and len(waiting) < app_config.PROBE_MAX_SOCKETS:
+                idx, (query, record_type, address, timeout) = pending.popleft()
+                started = time.monotonic()
+                try:
+                    if address is None:
+                        raise OSError('Resolver address is not resolved')
+                    family, address = address
+                    sock = sockets.get(family)
+                    if sock is None:
+                        sock = socket.socket(family, socket.SOCK_DGRAM)
+                        sock.setblocking(False)
+                        selector.register(sock, selectors.EVENT_READ)
+                        sockets[family] = sock
+                    query_id = (query_id + 1) & 0xFFFF
+                    sock.sendto(build_dns_query(query_id, query, record_type), address)
+                except (OSError, UnicodeError):
+                    results[idx] = (False, (time.monotonic() - started) * 1000)
+                    continue
+                waiting[(address[:2], query_id)] = (idx, started, started + timeout)
+
+            if not waiting:
+                continue
+            wait = max(0.0, min(w[2] for w in waiting.values()) - time.monotonic())
+            for key, _ in selector.select(wait):
+                while True:
+                    try:
+                        response, address = key.fileobj.recvfrom(4096)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError:
+                        break
+                    if len(response) < 2:
+                        continue
+                    item = waiting.pop((address[:2], struct.unpack('!H', response[:2])[0]), None)
+                    if item is not None:
+                        idx, started, _ = item
+                        results[idx] = (is_dns_answer(response), (time.monotonic() - started) * 1000)
+            now = time.monotonic()
+            for k in [k for k, w in waiting.items() if w[2] <= now]:
+                idx, started, _ = waiting.pop(k)
+                results[idx] = (False, (now - started) * 1000)
+    finally:
+        for sock in sockets.values():
+            sock.close()
+        selector.close()
+
+    if callback is not None:
+        callback(results)
+    else:
+        return results
+
 def get_net_iface_stat(name):
     return psutil.net_io_counters(pernic=True).get(name)
 
 def get_next_update_time(d):
-    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(d.updated_at + d.interval))
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(d.updated_at + d.interval * d.stretch))
 
 
 class DiskMetric(AbstractMetric):
@@ -160,28 +376,31 @@ class HealthMetric(AbstractMetric):
         super().__init__('health', config)
         for d in self.config:
             name, url, interval, timeout, method = d['name'], d['url'], d['interval'], d['timeout'], d['method']
-            if 'auth' in self.config:
+            if 'auth' in d:
                 user = d['auth']['user']
                 pwd = d['auth']['pass']
             else:
                 user = ''
                 pwd = ''
-            if 'headers' in self.config:
+            if 'headers' in d:
                 headers = d['headers']
             else:
                 headers = ''
-            result = is_health_check(url, timeout, method, user, pwd, headers)
-            self.data_array.append(HealthData(name, url, interval, timeout, result, method, user, pwd, headers, self.prefix))
+            expected_status = parse_status_ranges(d['expected_status'] if 'expected_status' in d else None)
+            is_up, status_code, response_time = is_health_check(url, timeout, method, user, pwd, headers, expected_status=expected_status)
+            self.data_array.append(HealthData(name, url, interval, timeout, is_up, method, user, pwd, headers, self.prefix,
+                                              status_code, response_time, expected_status))
 
     def proceed_metric(self):
         for d in self.data_array:
             if d.is_need_to_update():
-                thread = Thread(target=is_health_check, args=(d.url, d.timeout, d.method, d.user, d.password, d.headers, d.set_data))
-                thread.start()
+                self.start_probe([d], d.name, is_health_check, (d.url, d.timeout, d.method, d.user, d.password, d.headers,
+                                                           d.set_data, d.expected_status))
 
     def print_debug_info(self):
         for d in self.data_array:
-            print(f'[DEBUG] (next update at {get_next_update_time(d)}) {d.url}: {ENUM_UP_DN_STATES[0].upper() if d.is_up else ENUM_UP_DN_STATES[1].upper()}')
+            print(f'[DEBUG] (next update at {get_next_update_time(d)}) {d.url}: {ENUM_UP_DN_STATES[0].upper() if d.is_up else ENUM_UP_DN_STATES[1].upper()} '
+                  f'status={d.status_code} in {d.response_time:.2f} ms')
 
 
 class IcmpMetric(AbstractMetric):
@@ -195,14 +414,117 @@ class IcmpMetric(AbstractMetric):
     def proceed_metric(self):
         for d in self.data_array:
             if d.is_need_to_update():
-                thread = Thread(target=is_ping, args=(d.ip, d.count, d.set_data))
-                thread.start()
+                self.start_probe([d], d.name, is_ping, (d.ip, d.count, d.set_data))
 
     def print_debug_info(self):
         for d in self.data_array:
             print(f'[DEBUG] (next update at {get_next_update_time(d)}) {d.ip}: {"UP" if d.is_up else "DN"}')
 
 
+class TcpMetric(AbstractMetric):
+    def __init__(self, config):
+        super().__init__('tcp', config)
+        self.thread = None
+        for d in self.config:
+            name, host, port, interval, timeout = d['name'], d['host'], int(d['port']), d['interval'], d['timeout']
+            self.data_array.append(TcpData(name, host, port, interval, timeout, prefix=self.prefix))
+        self.update(self.data_array)
+
+    @staticmethod
+    def update(data):
+        refresh_addresses(data, lambda d: (d.host, d.port), socket.SOCK_STREAM)
+        results = check_tcp_connect([(d.address, d.timeout) for d in data])
+        for d, (is_up, latency) in zip(data, results):
+            d.set_data(is_up, latency)
+
+    def proceed_metric(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        data = [d for d in self.data_array if d.is_need_to_update()]
+        if data:
+            self.thread = self.start_probe(data, f'{len(data)} targets', self.update, (data,))
+
+    def print_debug_info(self):
+        for d in self.data_array:
+            print(f'[DEBUG] (next update at {get_next_update_time(d)}) {d.host}:{d.port}: {"UP" if d.is_up else "DN"} in {d.latency:.2f} ms')
+
+
+class DnsMetric(AbstractMetric):
+    def __init__(self, config):
+        super().__init__('dns', config)
+        self.thread = None
+        default_server = get_default_dns_server()
+        for d in self.config:
+            name, query, interval, timeout = d['name'], d['query'], d['interval'], d['timeout']
+            record_type = d['type'] if 'type' in d else 'A'
+            if record_type.upper() not in DNS_RECORD_TYPES:
+                raise Exception(f"Wrong DNS record type '{record_type}' of dns metric '{name}'")
+            dns_server = d['server'] if 'server' in d else default_server
+            dns_port = int(d['port']) if 'port' in d else 53
+            self.data_array.append(DnsData(name, query, record_type, dns_server, dns_port, interval, timeout, prefix=self.prefix))
+        self.update(self.data_array)
+
+    @staticmethod
+    def update(data):
+        refresh_addresses(data, lambda d: (d.dns_server, d.dns_port), socket.SOCK_DGRAM)
+        results = check_dns_resolve([(d.query, d.type, d.address, d.timeout) for d in data])
+        for d, (is_up, latency) in zip(data, results):
+            d.set_data(is_up, latency)
+
+    def proceed_metric(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        data = [d for d in self.data_array if d.is_need_to_update()]
+        if data:
+            self.thread = self.start_probe(data, f'{len(data)} queries', self.update, (data,))
+
+    def print_debug_info(self):
+        for d in self.data_array:
+            print(f'[DEBUG] (next update at {get_next_update_time(d)}) {d.query} ({d.type}) via {d.dns_server}:{d.dns_port}: '
+                  f'{"UP" if d.is_up else "DN"} in {d.latency:.2f} ms')
+
+
+class ProcessMetric(AbstractMetric):
+    def __init__(self, config):
+        super().__init__('process', config)
+        self.thread = None
+        for d in self.config:
+            name, interval = d['name'], d['interval']
+            if 'top' in d:
+                self.data_array.append(ProcessData(name, interval, top=int(d['top']), sort=d['sort'] if 'sort' in d else 'cpu', prefix=self.prefix))
+            else:
+                is_cmdline = str(d['cmdline']).lower() == 'true' if 'cmdline' in d else False
+                self.data_array.append(ProcessData(name, interval, d['match'], is_cmdline, prefix=self.prefix))
+        ProcessData.remove_top(self.prefix, {d.name for d in self.data_array if d.top})
+        if self.data_array:
+            SCANNER.set_groups({d.name: (d.match, d.is_cmdline) for d in self.data_array if not d.top})
+            self.update(self.data_array)
+
+    @staticmethod
+    def update(data):
+        # one /proc scan serves all the due items; an earlier scan is reused if it's younger than the shortest interval
+        SCANNER.scan(min(d.interval for d in data) / 2)
+        for d in data:
+            d.set_data(SCANNER.get_top(d.top, d.sort) if d.top else SCANNER.get_group(d.name))
+
+    def proceed_metric(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        data = [d for d in self.data_array if d.is_need_to_update()]
+        if data:
+            self.thread = self.start_probe(data, f'{len(data)} items', self.update, (data,))
+
+    def print_debug_info(self):
+        for d in self.data_array:
+            if d.top:
+                top = ', '.join(f'{comm}:{pid} cpu={cpu:.1f}% rss={rss // 2 ** 20} Mb' for pid, comm, cpu, rss, _, _ in d.summary)
+                print(f'[DEBUG] (next update at {get_next_update_time(d)}) Top {d.top} processes by {d.sort}: {top}')
+            else:
+                count, cpu, rss, threads, fds = d.summary
+                print(f'[DEBUG] (next update at {get_next_update_time(d)}) Processes "{d.match}": count={count} cpu={cpu:.1f}% '
+                      f'rss={rss // 2 ** 20} Mb threads={threads} fds={fds}')
+
+
 class InterfaceMetric(AbstractMetric):
     def __init__(self, config):
         super().__init__('iface', config)
@@ -245,9 +567,8 @@ class RestValueMetric(AbstractMetric):
     def proceed_metric(self):
         for d in self.data_array:
             if d.is_need_to_update():
-                thread = Thread(target=get_rest_value, args=(d.url, d.timeout, d.method, d.user, d.password, d.headers,
-                                                             d.set_data, d.type, d.path))
-                thread.start()
+                self.start_probe([d], d.name, get_rest_value, (d.url, d.timeout, d.method, d.user, d.password, d.headers,
+                                                          d.set_data, d.type, d.path))
 
     def print_debug_info(self):
         for d in self.data_array:
@@ -265,8 +586,7 @@ class ShellValueMetric(AbstractMetric):
     def proceed_metric(self):
         for d in self.data_array:
             if d.is_need_to_update():
-                thread = Thread(target=get_shell_value, args=(d.command, d.args, d.set_data))
-                thread.start()
+                self.start_probe([d], d.name, get_shell_value, (d.command, d.args, d.set_data))
 
     def print_debug_info(self):
         for d in self.data_array:
@@ -301,7 +621,28 @@ class SystemMetric(AbstractMetric):
     def print_debug_info(self):
         for d in self.data_array:
             print(f'[DEBUG] (next update at {get_next_update_time(d)}) CPU: {d.cpu}% Mem: {d.memory}% Uptime: {d.uptime}s '
-                  f'CPU temperature: {d.cpu_temp} Chassis temperature: {d.ch_temp}')
+                  f'CPU temperature: {"n/a" if d.cpu_temp is None else d.cpu_temp} '
+                  f'Chassis temperature: {"n/a" if d.ch_temp is None else d.ch_temp} Sensors: {len(d.sensors)}')
+
+
+class ExporterMetric(AbstractMetric):
+    def __init__(self, interval):
+        super().__init__(None, {})
+        self.data_array.append(ExporterData(interval, self.prefix))
+
+    @staticmethod
+    def set_loop_time(seconds):
+        ExporterData.set_loop_time(seconds)
+
+    def proceed_metric(self):
+        for d in self.data_array:
+            if d.is_need_to_update():
+                d.set_data()
+
+    def print_debug_info(self):
+        for d in self.data_array:
+            print(f'[DEBUG] (next update at {get_next_update_time(d)}) Exporter: threads={d.threads} fds={d.fds} '
+                  f'RSS={d.rss // 2 ** 20} Mb probes={d.probes} loop={d.loop_time:.3f}s overruns={d.loop_overruns}')
 
 
 if __name__ == '__main__':
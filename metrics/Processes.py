@@ -0,0 +1,152 @@
+import heapq
+import os
+import re
+import sys
+import time
+from threading import Lock
+
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+# /proc/[pid]/stat fields after the "(comm)" one, see proc(5)
+STAT_UTIME, STAT_STIME, STAT_THREADS, STAT_START_TIME, STAT_RSS = 11, 12, 17, 19, 21
+
+# process record: [pid, comm, ticks, rss_bytes, threads, cpu_percent]
+PID, COMM, TICKS, RSS, THREADS, CPU = range(6)
+
+
+class ProcessScanner:
+    # reads /proc/[pid]/stat of every process once per scan; process name and command line are read
+    # only for new processes to match them to the groups, the match result is kept until the process exits
+    def __init__(self, proc_path='/proc'):
+        self.proc_path = proc_path
+        self.scanned_at = 0.0
+        self.processes = {}
+        self.members = {}
+        self.matchers = {}
+        # the scanner is shared: a reload may set new groups while the previous probe is still scanning
+        self.lock = Lock()
+
+    def set_groups(self, groups):
+        # groups: {name: (regex, is_cmdline)}
+        with self.lock:
+            self.matchers = {name: (re.compile(regex), is_cmdline) for name, (regex, is_cmdline) in groups.items()}
+            self.members = {}
+
+    def read_cmdline(self, pid):
+        try:
+            with open(f'{self.proc_path}/{pid}/cmdline', 'rb') as f:
+                return f.read().replace(b'\x00', b' ').decode(errors='replace').strip()
+        except OSError:
+            return ''
+
+    def match_groups(self, pid, comm):
+        cmdline = None
+        groups = []
+        for name, (regex, is_cmdline) in self.matchers.items():
+            if is_cmdline and cmdline is None:
+                cmdline = self.read_cmdline(pid)
+            if regex.search(cmdline if is_cmdline else comm):
+                groups.append(name)
+        return tuple(groups)
+
+    def scan(self, max_age=0.0):
+        with self.lock:
+            self.scan_processes(max_age)
+
+    def scan_processes(self, max_age):
+        now = time.monotonic()
+        if now - self.scanned_at < max_age:
+            return
+        elapsed = now - self.scanned_at
+        processes, members = {}, {}
+        for entry in os.listdir(self.proc_path):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'{self.proc_path}/{entry}/stat', 'rb') as f:
+                    data = f.read()
+                comm_end = data.rindex(b')')
+                fields = data[comm_end + 2:].split()
+                ticks = int(fields[STAT_UTIME]) + int(fields[STAT_STIME])
+                key = (int(entry), int(fields[STAT_START_TIME]))
+            except (OSError, ValueError, IndexError):
+                continue
+            previous = self.processes.get(key)
+            if previous is None:
+                process = [key[0], data[data.index(b'(') + 1:comm_end].decode(errors='replace'), ticks, 0, 0, 0.0]
+            else:
+                process = previous
+                process[CPU] = (ticks - previous[TICKS]) / CLK_TCK / elapsed * 100
+                process[TICKS] = ticks
+            process[RSS] = int(fields[STAT_RSS]) * PAGE_SIZE
+            process[THREADS] = int(fields[STAT_THREADS])
+            processes[key] = process
+            groups = self.members.get(key)
+            members[key] = self.match_groups(key[0], process[COMM]) if groups is None else groups
+        self.processes, self.members = processes, members
+        self.scanned_at = now
+
+    def count_fds(self, pid):
+        try:
+            return len(os.listdir(f'{self.proc_path}/{pid}/fd'))
+        except OSError:
+            return 0
+
+    def get_group(self, name):
+        # summary of the group: (count, cpu_percent, rss_bytes, threads, fds)
+        count, cpu, rss, threads, fds = 0, 0.0, 0, 0, 0
+        with self.lock:
+            members = [list(self.processes[key]) for key, groups in self.members.items() if name in groups]
+        for process in members:
+            count += 1
+            cpu += process[CPU]
+            rss += process[RSS]
+            threads += process[THREADS]
+            fds += self.count_fds(process[PID])
+        return count, cpu, rss, threads, fds
+
+    def get_top(self, amount, sort='cpu'):
+        # top processes: [(pid, comm, cpu_percent, rss_bytes, threads, fds)]
+        field = RSS if sort == 'rss' else CPU
+        with self.lock:
+            top = [list(p) for p in heapq.nlargest(amount, self.processes.values(), key=lambda p: p[field])]
+        return [(p[PID], p[COMM], p[CPU], p[RSS], p[THREADS], self.count_fds(p[PID])) for p in top]
+
+
+SCANNER = ProcessScanner()
+
+
+def write_fake_process(path, pid, comm, cmdline, utime=0, stime=0, threads=1, start_time=0, rss=0):
+    os.makedirs(f'{path}/{pid}/fd', exist_ok=True)
+    with open(f'{path}/{pid}/stat', 'w') as f:
+        f.write(f'{pid} ({comm}) S 1 {pid} {pid} 0 -1 4194560 100 0 0 0 {utime} {stime} 0 0 20 0 '
+                f'{threads} 0 {start_time} 1000000 {rss} 18446744073709551615 0 0 0 0 0 0 0 0 0 0 0 0 17 0 0 0 0 0 0\n')
+    with open(f'{path}/{pid}/cmdline', 'w') as f:
+        f.write('\x00'.join(cmdline) + '\x00')
+
+
+def make_fake_proc(path, amount):
+    for pid in range(1, amount + 1):
+        write_fake_process(path, pid, f'worker-{pid % 50}', ['/usr/bin/worker', '--id', str(pid)],
+                           pid % 97, pid % 13, 1 + pid % 4, pid * 10, 100 + pid % 1000)
+
+
+def benchmark(amount):
+    import tempfile
+    with tempfile.TemporaryDirectory() as path:
+        make_fake_proc(path, amount)
+        scanner = ProcessScanner(path)
+        scanner.set_groups({'workers': ('worker-1', False), 'id7': ('--id 7', True)})
+        for title in ('first scan (groups matching)', 'next scan (cached groups)', 'next scan (cached groups)'):
+            started = time.perf_counter()
+            scanner.scan()
+            print(f'{amount} processes, {title}: {(time.perf_counter() - started) * 1000:.1f} ms')
+        started = time.perf_counter()
+        scanner.get_group('workers')
+        scanner.get_top(10)
+        print(f'{amount} processes, group and top 10 summary: {(time.perf_counter() - started) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    # benchmark on a fake /proc: python -m metrics.Processes 20000
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
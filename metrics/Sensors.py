@@ -0,0 +1,91 @@
+import glob
+import os
+
+SYS_CLASS_PATH = '/sys/class'
+# sensor record: (type, chip, device, sensor, path)
+TEMPERATURE, FAN = 'temperature', 'fan'
+
+
+def read_text(path, default=''):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+def read_sensor(sensor_type, path):
+    # returns the current reading (Celsius degrees or RPM) or None if the sensor can't be read
+    try:
+        with open(path, 'rb') as f:
+            value = int(f.read())
+    except (OSError, ValueError):
+        return None
+    return value / 1000 if sensor_type == TEMPERATURE else value
+
+def discover_hwmon(root):
+    sensors = []
+    for hwmon in sorted(glob.glob(f'{root}/hwmon/hwmon*')):
+        device = os.path.basename(hwmon)
+        chip = read_text(f'{hwmon}/name', device)
+        # older drivers keep the sensor files in the device subdirectory
+        inputs = glob.glob(f'{hwmon}/temp*_input') + glob.glob(f'{hwmon}/fan*_input') or \
+                 glob.glob(f'{hwmon}/device/temp*_input') + glob.glob(f'{hwmon}/device/fan*_input')
+        for path in sorted(inputs, key=lambda p: (len(p), p)):
+            base = os.path.basename(path)[:-len('_input')]
+            sensor = read_text(os.path.join(os.path.dirname(path), f'{base}_label'), base)
+            sensors.append((TEMPERATURE if base.startswith('temp') else FAN, chip, device, sensor, path))
+    return sensors
+
+def discover_thermal_zones(root, chips):
+    # thermal zones usually duplicate the hwmon chips, only the missing ones are added
+    sensors = []
+    for zone in sorted(glob.glob(f'{root}/thermal/thermal_zone*'), key=lambda p: (len(p), p)):
+        device = os.path.basename(zone)
+        chip = read_text(f'{zone}/type', device)
+        if chip not in chips and os.path.isfile(f'{zone}/temp'):
+            sensors.append((TEMPERATURE, chip, device, device, f'{zone}/temp'))
+    return sensors
+
+def discover_sensors(root=SYS_CLASS_PATH):
+    sensors = discover_hwmon(root)
+    return sensors + discover_thermal_zones(root, {s[1] for s in sensors})
+
+def get_devices_signature(root=SYS_CLASS_PATH):
+    # changes when a hwmon device or thermal zone appears or disappears
+    signature = []
+    for directory in ('hwmon', 'thermal'):
+        try:
+            signature.append(tuple(sorted(os.listdir(f'{root}/{directory}'))))
+        except OSError:
+            signature.append(())
+    return tuple(signature)
+
+
+class SensorCache:
+    # sensors are discovered once and on hotplug, then every read touches only their input files
+    def __init__(self, root=SYS_CLASS_PATH):
+        self.root = root
+        self.signature = None
+        self.sensors = []
+
+    def refresh(self):
+        signature = get_devices_signature(self.root)
+        if signature != self.signature:
+            self.sensors = discover_sensors(self.root)
+            self.signature = signature
+
+    def read(self):
+        # returns [((type, chip, device, sensor), value or None)]
+        self.refresh()
+        readings = []
+        for sensor in self.sensors:
+            value = read_sensor(sensor[0], sensor[4])
+            if value is None and not os.path.exists(sensor[4]):
+                # the sensor has gone away without the devices listing change, discover again on the next read
+                self.signature = None
+            readings.append((sensor[:4], value))
+        return readings
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,58 @@
+import time
+
+import app_config
+from metrics.DataStructures import get_gauge_metric
+
+PRIORITIES = ['high', 'normal', 'low']
+# overload level at which 'low' items reach their maximal stretch and 'normal' items start to be stretched
+LOW_MAX_LEVEL = 3
+MAX_LEVEL = 6
+
+level = 0
+
+
+def get_stretch(priority, shed_level):
+    if priority == 'low':
+        return 2 ** min(shed_level, LOW_MAX_LEVEL)
+    if priority == 'normal':
+        return 2 ** max(shed_level - LOW_MAX_LEVEL, 0)
+    return 1
+
+def get_overdue_threshold(items_count):
+    # a single hung probe isn't an overload, a pile-up of them is
+    return max(2, items_count * app_config.OVERLOAD_OVERDUE_PERCENT / 100)
+
+def update(metric_objects, prefix=''):
+    # called after every main loop iteration. The exporter is overloaded if the metrics are dispatched too late
+    # (the scheduling lag of all the items measured against their current intervals) or if too many probes
+    # are still running when their items are due again. While overloaded the intervals of low priority items are stretched
+    global level
+    now = int(time.time())
+    items = [(m.metric_key or d.name, d) for m in metric_objects for d in m.data_array]
+    lag = max((d.lag for _, d in items), default=0)
+    overdue_in_flight = sum(1 for _, d in items if d.in_flight and d.get_overdue(now) >= 0)
+    overdue_threshold = get_overdue_threshold(len(items))
+    if lag > app_config.OVERLOAD_LAG_SECONDS or overdue_in_flight >= overdue_threshold:
+        level = min(level + 1, MAX_LEVEL)
+    elif lag < app_config.OVERLOAD_LAG_SECONDS / 2 and overdue_in_flight < overdue_threshold / 2:
+        level = max(level - 1, 0)
+
+    g_factor = get_gauge_metric('das_exporter_shed_factor', 'Interval multiplier of shed [metric, name, priority] on [server]',
+                                ['metric', 'name', 'priority', 'server'])
+    for key, d in items:
+        d.lag = 0
+        stretch = get_stretch(d.priority, level)
+        if stretch != d.stretch:
+            d.stretch = stretch
+            d.stretched_at = now
+        g_factor.labels(metric=key, name=d.name, priority=d.priority, server=prefix).set(d.stretch)
+    get_gauge_metric('das_exporter_schedule_lag_seconds', 'Longest scheduling lag of metrics on [server] in seconds',
+                     ['server']).labels(server=prefix).set(lag)
+    get_gauge_metric('das_exporter_overdue_probes', 'Metrics overdue because their previous probe is still running on [server]',
+                     ['server']).labels(server=prefix).set(overdue_in_flight)
+    get_gauge_metric('das_exporter_shed_level', 'Load shedding level on [server], 0 if not overloaded',
+                     ['server']).labels(server=prefix).set(level)
+
+
+if __name__ == '__main__':
+    pass
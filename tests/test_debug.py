@@ -0,0 +1,28 @@
+import pytest
+
+from metrics.Debug import profile_handler, memory_handler
+
+
+@pytest.mark.parametrize('params', [{'seconds': 'abc'}, {'interval_ms': 'fast'}, {'limit': '1.5'}, {'seconds': 'nan'}])
+def test_profile_bad_params(params):
+    status, _, body = profile_handler(params)
+    assert status == '400 Bad Request'
+    assert 'must be numbers' in body
+
+
+@pytest.mark.parametrize('params', [{'seconds': 'abc'}, {'limit': 'ten'}])
+def test_memory_bad_params(params):
+    assert memory_handler(params)[0] == '400 Bad Request'
+
+
+def test_profile_top():
+    status, _, body = profile_handler({'seconds': '0.05', 'format': 'top', 'limit': '3'})
+    assert status == '200 OK'
+    assert body.startswith('  own %')
+    assert len(body.splitlines()) <= 4
+
+
+def test_memory_top():
+    status, _, body = memory_handler({'seconds': '0', 'limit': '2'})
+    assert status == '200 OK'
+    assert body.startswith('Top 2 allocators')
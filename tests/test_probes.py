@@ -0,0 +1,190 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+import app_config
+import metrics.MetricClasses as MetricClasses
+from metrics.DataStructures import TcpData
+from metrics.MetricClasses import check_tcp_connect, check_dns_resolve, resolve_address, refresh_addresses, DnsMetric
+
+LOCALHOST = '127.0.0.1'
+
+
+def address(port, sock_type=socket.SOCK_STREAM):
+    return resolve_address(LOCALHOST, port, sock_type)
+
+
+@pytest.fixture
+def open_port():
+    server = socket.create_server((LOCALHOST, 0))
+    yield server.getsockname()[1]
+    server.close()
+
+
+@pytest.fixture
+def closed_port():
+    sock = socket.socket()
+    sock.bind((LOCALHOST, 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@pytest.fixture
+def timeout_port():
+    # the listener never accepts and its backlog is full, so the next SYN is dropped and the connect times out
+    server = socket.socket()
+    server.bind((LOCALHOST, 0))
+    server.listen(0)
+    port = server.getsockname()[1]
+    clients = []
+    for _ in range(8):
+        client = socket.socket()
+        client.setblocking(False)
+        client.connect_ex((LOCALHOST, port))
+        clients.append(client)
+    time.sleep(0.1)
+    yield port
+    for client in clients:
+        client.close()
+    server.close()
+
+
+@pytest.fixture
+def dns_port():
+    # stand-in resolver: names with "good" get an answer, with "bad" NXDOMAIN, with "silent" nothing
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind((LOCALHOST, 0))
+
+    def respond():
+        while True:
+            try:
+                request, client = server.recvfrom(512)
+            except OSError:
+                return
+            question = request[12:]
+            if b'silent' in question:
+                continue
+            if b'good' in question:
+                header = struct.pack('!HHHHH', 0x8180, 1, 1, 0, 0)
+            else:
+                header = struct.pack('!HHHHH', 0x8183, 1, 0, 0, 0)
+            server.sendto(request[:2] + header + question, client)
+
+    threading.Thread(target=respond, daemon=True).start()
+    yield server.getsockname()[1]
+    server.close()
+
+
+def test_tcp_open_port_is_up(open_port):
+    [(is_up, latency)] = check_tcp_connect([(address(open_port), 1)])
+    assert is_up
+    assert latency < 1000
+
+
+def test_tcp_closed_port_is_down(closed_port):
+    [(is_up, latency)] = check_tcp_connect([(address(closed_port), 1)])
+    assert not is_up
+    assert latency < 1000
+
+
+def test_tcp_timed_out_port_is_down(timeout_port):
+    [(is_up, latency)] = check_tcp_connect([(address(timeout_port), 0.3)])
+    assert not is_up
+    assert latency >= 300
+
+
+def test_tcp_unresolved_address_is_down():
+    assert check_tcp_connect([(None, 1)]) == [(False, pytest.approx(0, abs=10))]
+
+
+def test_tcp_results_keep_targets_order(open_port, closed_port):
+    results = check_tcp_connect([(address(open_port), 1), (address(closed_port), 1)] * 50)
+    assert [is_up for is_up, _ in results] == [True, False] * 50
+
+
+def test_tcp_callback_gets_results(open_port):
+    results = []
+    check_tcp_connect([(address(open_port), 1)], results.extend)
+    assert results[0][0]
+
+
+def test_tcp_max_sockets_limit(monkeypatch, timeout_port):
+    targets = [(address(timeout_port), 0.2)] * 3
+    monkeypatch.setattr(app_config, 'PROBE_MAX_SOCKETS', 3)
+    started = time.monotonic()
+    check_tcp_connect(targets)
+    assert time.monotonic() - started < 0.5
+    monkeypatch.setattr(app_config, 'PROBE_MAX_SOCKETS', 1)
+    started = time.monotonic()
+    check_tcp_connect(targets)
+    assert time.monotonic() - started >= 0.6
+
+
+def test_dns_answer_is_up(dns_port):
+    [(is_up, latency)] = check_dns_resolve([('good.example', 'A', address(dns_port, socket.SOCK_DGRAM), 1)])
+    assert is_up
+    assert latency < 1000
+
+
+def test_dns_nxdomain_is_down(dns_port):
+    [(is_up, latency)] = check_dns_resolve([('bad.example', 'A', address(dns_port, socket.SOCK_DGRAM), 1)])
+    assert not is_up
+    assert latency < 1000
+
+
+def test_dns_timeout_is_down(dns_port):
+    [(is_up, latency)] = check_dns_resolve([('silent.example', 'AAAA', address(dns_port, socket.SOCK_DGRAM), 0.3)])
+    assert not is_up
+    assert latency >= 300
+
+
+def test_dns_results_keep_queries_order(dns_port):
+    resolver = address(dns_port, socket.SOCK_DGRAM)
+    queries = [(f'good{i}.example', 'A', resolver, 2) for i in range(100)] + [('bad.example', 'MX', resolver, 2)]
+    results = check_dns_resolve(queries)
+    assert [is_up for is_up, _ in results] == [True] * 100 + [False]
+
+
+def test_dns_max_sockets_limit(monkeypatch, dns_port):
+    queries = [('silent.example', 'A', address(dns_port, socket.SOCK_DGRAM), 0.2)] * 3
+    monkeypatch.setattr(app_config, 'PROBE_MAX_SOCKETS', 3)
+    started = time.monotonic()
+    check_dns_resolve(queries)
+    assert time.monotonic() - started < 0.5
+    monkeypatch.setattr(app_config, 'PROBE_MAX_SOCKETS', 1)
+    started = time.monotonic()
+    check_dns_resolve(queries)
+    assert time.monotonic() - started >= 0.6
+
+
+def test_failed_lookup_is_not_retried_until_cache_expires(monkeypatch):
+    lookups = []
+    monkeypatch.setattr(MetricClasses, 'resolve_address', lambda host, port, sock_type: lookups.append(host))
+    data = [TcpData('dead', 'dead.invalid', 80, 60, 1, prefix='resolve-test')]
+    get_host_port = lambda d: (d.host, d.port)
+    refresh_addresses(data, get_host_port, socket.SOCK_STREAM)
+    refresh_addresses(data, get_host_port, socket.SOCK_STREAM)
+    assert lookups == ['dead.invalid']
+    data[0].resolved_at -= app_config.RESOLVE_CACHE_SECONDS
+    refresh_addresses(data, get_host_port, socket.SOCK_STREAM)
+    assert lookups == ['dead.invalid'] * 2
+
+
+def test_lookups_run_in_parallel(monkeypatch):
+    def slow_resolve(host, port, sock_type):
+        time.sleep(0.2)
+    monkeypatch.setattr(MetricClasses, 'resolve_address', slow_resolve)
+    data = [TcpData(f'slow-{i}', f'slow-{i}.invalid', 80, 60, 1, prefix='resolve-test') for i in range(8)]
+    started = time.monotonic()
+    refresh_addresses(data, lambda d: (d.host, d.port), socket.SOCK_STREAM)
+    assert time.monotonic() - started < 1
+
+
+def test_dns_unknown_record_type_is_rejected():
+    config = {'dns': [{'name': 'caa', 'query': 'example.com', 'type': 'CAA', 'server': LOCALHOST, 'interval': 30, 'timeout': 1}]}
+    with pytest.raises(Exception, match="Wrong DNS record type 'CAA'"):
+        DnsMetric(config)
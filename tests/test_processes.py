@@ -0,0 +1,96 @@
+import time
+
+import pytest
+from prometheus_client import REGISTRY
+
+from metrics.DataStructures import ProcessData
+from metrics.Processes import CLK_TCK, PAGE_SIZE, ProcessScanner, make_fake_proc, write_fake_process
+
+
+@pytest.fixture
+def proc_path(tmp_path):
+    write_fake_process(tmp_path, 10, 'nginx', ['/usr/sbin/nginx', '-g', 'daemon off;'], threads=2, rss=100)
+    write_fake_process(tmp_path, 11, 'nginx', ['nginx: worker process'], threads=1, rss=50)
+    write_fake_process(tmp_path, 20, 'python3', ['/usr/bin/python3', '/opt/app/nginx_stats.py'], threads=4, rss=300)
+    write_fake_process(tmp_path, 30, 'sshd', ['/usr/sbin/sshd', '-D'], rss=10)
+    (tmp_path / 'self').mkdir()
+    return tmp_path
+
+
+def rescan(scanner):
+    # pretend the previous scan was a second ago
+    scanner.scanned_at = time.monotonic() - 1
+    scanner.scan()
+
+
+def test_group_by_name_and_cmdline(proc_path):
+    scanner = ProcessScanner(proc_path)
+    scanner.set_groups({'by_name': ('^nginx$', False), 'by_cmdline': ('nginx', True), 'none': ('postgres', False)})
+    scanner.scan()
+    count, _, rss, threads, fds = scanner.get_group('by_name')
+    assert (count, rss, threads, fds) == (2, 150 * PAGE_SIZE, 3, 0)
+    count, _, rss, threads, _ = scanner.get_group('by_cmdline')
+    assert (count, rss, threads) == (3, 450 * PAGE_SIZE, 7)
+    assert scanner.get_group('none') == (0, 0.0, 0, 0, 0)
+
+
+def test_cpu_from_ticks_delta(proc_path):
+    scanner = ProcessScanner(proc_path)
+    scanner.set_groups({'nginx': ('nginx', False)})
+    scanner.scan()
+    write_fake_process(proc_path, 10, 'nginx', ['nginx'], utime=CLK_TCK // 4, stime=CLK_TCK // 4)
+    write_fake_process(proc_path, 11, 'nginx', ['nginx'], utime=CLK_TCK // 10)
+    rescan(scanner)
+    assert scanner.get_group('nginx')[1] == pytest.approx(60, rel=0.05)
+
+
+def test_reused_pid_is_new_process(proc_path):
+    scanner = ProcessScanner(proc_path)
+    scanner.set_groups({'nginx': ('nginx', False), 'sshd': ('sshd', False)})
+    scanner.scan()
+    # pid 30 exited and was reused by an nginx process started later with more ticks than the old one had
+    write_fake_process(proc_path, 30, 'nginx', ['nginx'], utime=CLK_TCK * 100, start_time=500)
+    rescan(scanner)
+    assert scanner.get_group('sshd')[0] == 0
+    count, cpu, _, _, _ = scanner.get_group('nginx')
+    assert count == 3
+    # the new process has no previous ticks to compare with, it isn't billed for the old one's time
+    assert cpu == 0
+
+
+def test_top_ordering(proc_path):
+    scanner = ProcessScanner(proc_path)
+    scanner.scan()
+    for pid, ticks, rss in ((10, 1, 200), (11, 3, 100), (20, 2, 50), (30, 0, 1000)):
+        write_fake_process(proc_path, pid, 'p', ['p'], utime=CLK_TCK * ticks, rss=rss)
+    rescan(scanner)
+    assert [p[0] for p in scanner.get_top(3)] == [11, 20, 10]
+    assert [p[0] for p in scanner.get_top(2, 'rss')] == [30, 10]
+    pid, comm, cpu, rss, threads, fds = scanner.get_top(1)[0]
+    # the name is read once when the process is found
+    assert (pid, comm, threads, fds) == (11, 'nginx', 1, 0)
+    assert cpu == pytest.approx(300, rel=0.05)
+
+
+def test_fake_proc(tmp_path):
+    make_fake_proc(tmp_path, 200)
+    scanner = ProcessScanner(tmp_path)
+    scanner.set_groups({'workers': ('^worker-1$', False), 'id7': ('--id 7$', True)})
+    scanner.scan()
+    assert scanner.get_group('workers')[0] == 4
+    assert scanner.get_group('id7')[0] == 1
+    assert len(scanner.get_top(500)) == 200
+
+
+def top_processes(server):
+    return {s.labels['process'] for m in REGISTRY.collect() if m.name == 'das_process_top'
+            for s in m.samples if s.labels['server'] == server}
+
+
+def test_top_series_removed_across_reloads():
+    ProcessData('top', 60, top=2, prefix='reload-test').set_top([(1, 'a', 0, 0, 0, 0), (2, 'b', 0, 0, 0, 0)])
+    # a config reload creates the item again
+    ProcessData('top', 60, top=2, prefix='reload-test').set_top([(1, 'a', 0, 0, 0, 0), (3, 'c', 0, 0, 0, 0)])
+    assert top_processes('reload-test') == {'a:1', 'c:3'}
+    ProcessData.remove_top('reload-test', set())
+    assert top_processes('reload-test') == set()
@@ -0,0 +1,126 @@
+import time
+
+import pytest
+
+import app_config
+import metrics.Shedding as Shedding
+from metrics.DataStructures import AbstractData
+from metrics.MetricClasses import AbstractMetric
+
+
+class FakeMetric(AbstractMetric):
+    def __init__(self, key, priorities):
+        super().__init__(key, {})
+        for i, priority in enumerate(priorities):
+            d = AbstractData(f'{key}-{i}', 10)
+            d.priority = priority
+            self.data_array.append(d)
+
+    def proceed_metric(self):
+        pass
+
+    def print_debug_info(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def shedding_config(monkeypatch):
+    monkeypatch.setattr(app_config, 'OVERLOAD_LAG_SECONDS', 10)
+    monkeypatch.setattr(app_config, 'OVERLOAD_OVERDUE_PERCENT', 10)
+    monkeypatch.setattr(Shedding, 'level', 0)
+
+
+def run_loop(metrics, lag=0):
+    for m in metrics:
+        for d in m.data_array:
+            d.lag = lag
+    Shedding.update(metrics)
+    return Shedding.level
+
+
+def stretches(metric):
+    return [d.stretch for d in metric.data_array]
+
+
+@pytest.mark.parametrize('priority, shed_level, stretch', [
+    ('high', 0, 1), ('high', 6, 1),
+    ('low', 0, 1), ('low', 1, 2), ('low', 3, 8), ('low', 6, 8),
+    ('normal', 0, 1), ('normal', 3, 1), ('normal', 4, 2), ('normal', 6, 8),
+])
+def test_get_stretch(priority, shed_level, stretch):
+    assert Shedding.get_stretch(priority, shed_level) == stretch
+
+
+def test_lag_raises_level_up_to_max():
+    m = FakeMetric('shell_value', ['high', 'normal', 'low'])
+    assert [run_loop([m], lag=60) for _ in range(8)] == [1, 2, 3, 4, 5, 6, 6, 6]
+    assert stretches(m) == [1, 8, 8]
+
+
+def test_level_is_stable_when_everything_is_stretched():
+    # no high items: once all of them are stretched the lag must still be seen
+    m = FakeMetric('shell_value', ['normal', 'normal', 'low'])
+    levels = [run_loop([m], lag=60) for _ in range(10)]
+    assert levels == [1, 2, 3, 4, 5, 6, 6, 6, 6, 6]
+    assert stretches(m) == [8, 8, 8]
+
+
+def test_level_goes_down_when_calm():
+    m = FakeMetric('shell_value', ['normal', 'low'])
+    for _ in range(4):
+        run_loop([m], lag=60)
+    assert [run_loop([m]) for _ in range(5)] == [3, 2, 1, 0, 0]
+    assert stretches(m) == [1, 1]
+
+
+def test_middle_lag_keeps_level():
+    m = FakeMetric('shell_value', ['low'])
+    run_loop([m], lag=60)
+    assert run_loop([m], lag=7) == 1
+
+
+def test_embedded_metrics_are_never_shed():
+    embedded = FakeMetric(None, ['normal'])
+    embedded.set_priorities()
+    m = FakeMetric('shell_value', ['normal', 'low'])
+    for _ in range(8):
+        run_loop([embedded, m], lag=60)
+    assert embedded.data_array[0].priority == 'high'
+    assert stretches(embedded) == [1]
+
+
+def overdue_in_flight(metric, amount):
+    for d in metric.data_array[:amount]:
+        d.in_flight = True
+        d.updated_at = int(time.time()) - 100
+
+
+def test_single_hung_probe_is_not_overload():
+    m = FakeMetric('shell_value', ['high', 'normal', 'low'])
+    overdue_in_flight(m, 1)
+    assert [run_loop([m]) for _ in range(3)] == [0, 0, 0]
+
+
+def test_probes_pile_up_is_overload():
+    m = FakeMetric('shell_value', ['normal'] * 10 + ['low'] * 10)
+    overdue_in_flight(m, 4)
+    assert [run_loop([m]) for _ in range(3)] == [1, 2, 3]
+
+
+def test_in_flight_item_is_not_dispatched():
+    d = AbstractData('hung', 1)
+    d.updated_at = int(time.time()) - 100
+    d.in_flight = True
+    assert not d.is_need_to_update()
+    assert d.lag == 0
+    d.in_flight = False
+    assert d.is_need_to_update()
+    assert d.lag >= 99
+
+
+def test_lag_is_ignored_right_after_interval_is_shortened():
+    d = AbstractData('relaxed', 1)
+    d.updated_at = int(time.time()) - 100
+    d.stretched_at = int(time.time())
+    assert d.is_need_to_update()
+    assert d.lag == 0